@@ -3,3 +3,5 @@
 __author__ = """Rodolphe Mete Soyding"""
 __email__ = 'r.soyding@gmail.com'
 __version__ = '0.1.0'
+
+from .caroa04 import CaroA04  # noqa: F401,E402
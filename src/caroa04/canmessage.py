@@ -1,5 +1,6 @@
 import numpy
 import logging
+import time
 import can
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -23,6 +24,8 @@ class CanMessage:
         self._identifier = can_id
         self.cycle_ms = cycle_ms
         self.is_extended = is_extended
+        self._last_payload = None  # last decoded payload, None when signals may differ from it
+        self._byte_signals = [[] for _ in range(dlc)]  # signals overlapping each byte of the payload
 
     def add(self, *signals):
         # Todo: check that added signals don't overlap each other
@@ -31,6 +34,8 @@ class CanMessage:
             assert signal.startbit + signal.length <= self.dlc * 8, "Signal out of message payload length"
             signal.set_parent(self)
             self.signals.append(signal)
+            for index in range(signal.startbit // 8, (signal.startbit + signal.length - 1) // 8 + 1):
+                self._byte_signals[index].append(signal)
             self._update_signal_in_payload(signal)
 
     def clear(self):
@@ -38,6 +43,8 @@ class CanMessage:
             signal.clear()
             self.signals.remove(signal)
         self._payload = [0] * self.dlc
+        self._last_payload = None
+        self._byte_signals = [[] for _ in range(self.dlc)]
 
     def get_cycle_ms(self):
         return self.cycle_ms
@@ -81,45 +88,75 @@ class CanMessage:
         assert index < self.dlc
         assert isinstance(value, int)
         self._payload[index] = value
+        self._last_payload = None
 
-    def update_payload(self, payload):
+    def update_payload(self, payload, timestamp=None):
+        """
+        Update the payload with received data and decode the signals from it.
+        :param payload: received data
+        :param timestamp: reception time of the data, recorded in the signals history (defaults to now)
+        :return: None
+        """
         assert len(payload) == self.dlc, "Payload length does not match message DLC"
         self._payload = payload
-        self._update_from_payload()
+        self._update_from_payload(timestamp)
+
+    def _update_from_payload(self, timestamp=None):
+        """
+        Update signals value from payload raw hex values.
+        Only the signals overlapping bytes that changed since the last decoded payload are decoded again.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        data = bytes(self._payload)
+        last_payload = self._last_payload
+        if last_payload is None or len(last_payload) != len(data):
+            changed = self.signals
+        elif data == last_payload:
+            changed = ()
+        else:
+            changed = set()
+            for index in range(len(data)):
+                if data[index] != last_payload[index]:
+                    changed.update(self._byte_signals[index])
+        self._last_payload = data
+
+        for signal in changed:
+            self._decode_signal(signal)
 
-    def _update_from_payload(self):
-        """Update signals value from payload raw hex values"""
         for signal in self.signals:
-            byte_index = 0
-            measured = 0
-
-            tmp_length = signal.length
-            tmp_startbit = signal.startbit
-            # Get the index of the first byte to be modified
-            if tmp_startbit % 8 == 0:
-                while tmp_length > 0:
-                    if tmp_length < 8:
-                        mask = eval("0b" + "1" * tmp_length)  # only the first "length" bits are to be considered
-                    else:
-                        mask = 0xff
-                    measured += (self._payload[tmp_startbit // 8] & mask) << (8 * byte_index)
-                    tmp_startbit += 8
-                    tmp_length -= 8
-                    byte_index += 1
-            else:
-                # Build the mask in binary first
-                tmpmask = [0 for _ in range(tmp_startbit % 8)]
-                tmpmask += [1 for _ in range(tmp_startbit % 8, tmp_startbit % 8 + tmp_length)]
-                tmpmask += [0 for _ in range(tmp_startbit % 8 + tmp_length, 8)]
-                mask = eval("0b" + "".join(
-                    [str(i) for i in reversed(tmpmask)]))  # convert the binary string into an hex then an int
-                measured += (self._payload[tmp_startbit // 8] & mask) >> (tmp_startbit % 8)
+            if signal.history is not None:
+                signal.history.append(signal.value, timestamp)
 
-            signal.value = int(measured + signal.offset) & int(f"0b{'1' * signal.length}", 2)
+    def _decode_signal(self, signal):
+        """Update a signal value from the payload raw hex values"""
+        byte_index = 0
+        measured = 0
+
+        tmp_length = signal.length
+        tmp_startbit = signal.startbit
+        # Get the index of the first byte to be modified
+        if tmp_startbit % 8 == 0:
+            while tmp_length > 0:
+                if tmp_length < 8:
+                    mask = (1 << tmp_length) - 1  # only the first "length" bits are to be considered
+                else:
+                    mask = 0xff
+                measured += (self._payload[tmp_startbit // 8] & mask) << (8 * byte_index)
+                tmp_startbit += 8
+                tmp_length -= 8
+                byte_index += 1
+        else:
+            mask = ((1 << tmp_length) - 1) << (tmp_startbit % 8)
+            measured += (self._payload[tmp_startbit // 8] & mask) >> (tmp_startbit % 8)
+
+        signal.value = int(measured + signal.offset) & ((1 << signal.length) - 1)
 
     def update(self):
         for signal in self.signals:
             self._update_signal_in_payload(signal)
+        self._last_payload = None  # payload now reflects the signals values, which may not have been received
 
     def _update_signal_in_payload(self, signal):
         """Update the message payload with the signal's value"""
@@ -188,10 +225,23 @@ class CanSignal:
         self.endianness = endianness
         self.type = type
         self.enum = enum
+        self.history = None
 
     def clear(self):
         self.parent = None
 
+    def enable_history(self, capacity):
+        """
+        Keep the last received raw values of the signal, with their timestamp.
+        :param capacity: maximum number of samples kept, older samples are overwritten
+        :return: the SignalHistory instance
+        """
+        self.history = SignalHistory(capacity)
+        return self.history
+
+    def disable_history(self):
+        self.history = None
+
     @property
     def raw(self):
         return self.value
@@ -218,6 +268,7 @@ class CanSignal:
     @raw.setter
     def raw(self, value):
         self.value = int(value + self.offset) & int(f"0b{'1'*self.length}", 2)
+        self._invalidate_parent()
 
     @phys.setter
     def phys(self, value):
@@ -240,10 +291,85 @@ class CanSignal:
                 self.value = ((value + self.offset) & int(f"0b{'1' * self.length}", 2))
             else:
                 self.value = round((int(value / float(self.factor)) + self.offset) & int(f"0b{'1' * self.length}", 2))
+        self._invalidate_parent()
 
     def set_parent(self, message):
         self.parent = message
 
+    def _invalidate_parent(self):
+        """The value no longer matches the last decoded payload, so the next received one must be fully decoded"""
+        if self.parent is not None:
+            self.parent._last_payload = None
+
+
+class SignalHistory:
+    """
+    Fixed capacity ring buffer of the raw values received for a signal, with their timestamp.
+    Buffers are allocated once, so that recording a sample does not allocate anything.
+    Queries return the samples in chronological order as (timestamps, values) numpy arrays.
+    """
+    def __init__(self, capacity):
+        assert isinstance(capacity, int), "History capacity should be an integer"
+        assert capacity > 0, "History capacity should be positive"
+        self.capacity = capacity
+        self._timestamps = numpy.zeros(capacity, dtype=numpy.float64)
+        self._values = numpy.zeros(capacity, dtype=numpy.float64)
+        self._index = 0  # position of the next sample to be written
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value, timestamp):
+        self._timestamps[self._index] = timestamp
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def clear(self):
+        self._index = 0
+        self._count = 0
+
+    def last(self, n=None):
+        """
+        Get the last samples.
+        :param n: number of samples to return (all samples if None)
+        :return: (timestamps, values) arrays, oldest sample first
+        """
+        if n is None or n > self._count:
+            n = self._count
+        indexes = numpy.arange(self._index - n, self._index) % self.capacity
+        return self._timestamps[indexes], self._values[indexes]
+
+    def since(self, t):
+        """
+        Get the samples received at or after a given time.
+        :param t: timestamp of the first sample to be returned
+        :return: (timestamps, values) arrays, oldest sample first
+        """
+        timestamps, values = self.last()
+        start = numpy.searchsorted(timestamps, t, side='left')
+        return timestamps[start:], values[start:]
+
+    def min(self, since=None):
+        """
+        Get the minimum value over the history, or over the samples received at or after since.
+        :param since: start of the window (whole history if None)
+        :return: minimum value, None if there is no sample in the window
+        """
+        _, values = self.last() if since is None else self.since(since)
+        return values.min() if len(values) else None
+
+    def max(self, since=None):
+        """
+        Get the maximum value over the history, or over the samples received at or after since.
+        :param since: start of the window (whole history if None)
+        :return: maximum value, None if there is no sample in the window
+        """
+        _, values = self.last() if since is None else self.since(since)
+        return values.max() if len(values) else None
+
 
 class XCanSignal(CanSignal):
     """
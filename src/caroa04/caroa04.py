@@ -1,10 +1,13 @@
 import can
 import logging
+import time
 import sys
 import pathlib
 sys.path.append(str(pathlib.Path(__file__).parent))
 
-from canmessage import CanMessageRW, XCanSignal, BOOL, ENUM
+from canmessage import CanMessage, CanMessageRW, CanSignal, XCanSignal, BOOL, ENUM
+from sequence import SequenceRunner
+from sharedstate import SharedStatePublisher
 
 logger = logging.getLogger(__name__)
 logger.propagate = True
@@ -39,6 +42,35 @@ BitrateEnum = {
 }
 
 
+def scan_bus(bus, timeout=1.0):
+    """
+    Find the devices connected to a bus.
+    An address code request is sent to every possible node ID back-to-back, then all the replies received within
+    the timeout are collected.
+    :param bus: bus to be scanned, it shall not be read by another thread (e.g. a notifier) during the scan
+    :param timeout: time to wait for the replies after the last request is sent, in seconds
+    :return: sorted list of the node IDs that replied
+    """
+    for node_id in range(0x100):
+        bus.send(can.Message(arbitration_id=MSGID_PARAM | node_id,
+                             data=[GET_ADDR_CODE_CMD, 0, 0, 0, 0, 0, 0, 0],
+                             is_extended_id=False),
+                 timeout=timeout)
+
+    found = set()
+    deadline = time.monotonic() + timeout
+    remaining = timeout
+    while remaining > 0:
+        msg = bus.recv(remaining)
+        if msg is not None and msg.is_rx and not msg.is_extended_id \
+                and msg.arbitration_id & 0x700 == MSGID_PARAM \
+                and len(msg.data) > 1 and msg.data[0] == GET_ADDR_CODE_CMD:
+            found.add(msg.arbitration_id & 0xFF)
+        remaining = deadline - time.monotonic()
+
+    return sorted(found)
+
+
 class CaroA04:
     """
     API to control the CaroA04 device from eletechsup.
@@ -55,6 +87,9 @@ class CaroA04:
         self._node_id = DEFAULT_NODEID
         self._bus = None
         self._notifier = None
+        self._sequences = list()
+        self._state_publisher = None
+        self._callbacks = list()
 
         self.message_do = CanMessageRW(self._node_id, MSGID_DO_READ, MSGID_DO_WRITE, dlc=8)
         self.message_di = CanMessageRW(self._node_id, MSGID_DI_READ, MSGID_DI_READ, dlc=8)
@@ -105,17 +140,22 @@ class CaroA04:
             self.node_id
         )
 
-    def start(self, node_id, interface=None, bitrate=None, channel=None):
+    def start(self, node_id, interface=None, bitrate=None, channel=None, shared_state=None):
         """
         Start the communication.
         :param node_id: node ID (or address code) of the device
         :param interface: CAN interface to be used for the communication
         :param bitrate: CAN speed
         :param channel: channel used for the communication
+        :param shared_state: if set, name of a shared memory segment where every received message is published so
+        that other processes can read the device state (see SharedStateReader and load_shared_state)
         :return: None
         """
         self._node_id = node_id
 
+        if shared_state is not None and self._state_publisher is None:
+            self._state_publisher = SharedStatePublisher(shared_state, list(self._shared_messages()))
+
         self.message_di.node_id = node_id
         self.message_do.node_id = node_id
         self.message_bitrate.node_id = node_id
@@ -135,6 +175,117 @@ class CaroA04:
 
         self._init_outputs()
 
+    @staticmethod
+    def scan(interface=None, channel=None, bitrate=None, all_bitrates=False, timeout=1.0):
+        """
+        Find the node ID and bitrate of the devices connected to a channel (see scan_bus).
+        The channel shall not be used by a started CaroA04 instance during the scan.
+        :param interface: CAN interface to be used for the communication
+        :param channel: channel used for the communication
+        :param bitrate: CAN speed to be scanned
+        :param all_bitrates: if True, scan every bitrate supported by the device instead
+        :param timeout: time to wait for the replies for each bitrate, in seconds
+        :return: list of (node ID, bitrate) tuples
+        """
+        bitrates = BitrateEnum.values() if all_bitrates else [bitrate]
+        devices = list()
+        for scanned_bitrate in bitrates:
+            bus = can.Bus(interface=interface, channel=channel, bitrate=scanned_bitrate)
+            try:
+                devices += [(node_id, scanned_bitrate) for node_id in scan_bus(bus, timeout)]
+            finally:
+                bus.shutdown()
+
+        return devices
+
+    def enable_history(self, capacity):
+        """
+        Keep a history of the last received values of the inputs and outputs.
+        The samples can then be queried with the history attribute of the signals (e.g. caro.di1.history.last(10)).
+        :param capacity: maximum number of samples kept per signal
+        :return: None
+        """
+        for signal in (self.do1, self.do2, self.do3, self.do4, self.di1, self.di2, self.di3, self.di4):
+            signal.enable_history(capacity)
+
+    def start_sequence(self, sequence):
+        """
+        Play a timed pattern of output states (see OutputSequence) in a dedicated thread.
+        The write messages of every step are computed before the sequence starts, from the current state of the
+        outputs, and sent at absolute deadlines without waiting for the device's response.
+        :param sequence: OutputSequence instance
+        :return: SequenceRunner thread, to be joined to wait for the end of the sequence. Its results attribute
+        holds the timing error of each step.
+        """
+        assert self._bus is not None, "Communication should be started before playing a sequence"
+        outputs = {name: getattr(self, name) for name in ('do1', 'do2', 'do3', 'do4')}
+
+        # use a copy of the outputs message to compute the payloads without changing the outputs states
+        message = CanMessage(self.message_do.write_id, dlc=self.message_do.dlc, is_extended=self.message_do.is_extended)
+        signals = dict()
+        for name, output in outputs.items():
+            signals[name] = CanSignal(startbit=output.startbit, length=output.length, type=output.type)
+            signals[name].value = output.value
+            message.add(signals[name])
+
+        steps = list()
+        for offset, states in sequence.steps():
+            for name, state in states.items():
+                assert name in signals, f"{name} is not an output"
+                signals[name].phys = state
+            steps.append((offset, can.Message(arbitration_id=message.arbitration_id,
+                                              data=bytes(message.payload),
+                                              is_extended_id=message.is_extended)))
+
+        self._sequences = [runner for runner in self._sequences if runner.is_alive()]
+        runner = SequenceRunner(self._bus, steps)
+        self._sequences.append(runner)
+        runner.start()
+        return runner
+
+    def load_shared_state(self, reader):
+        """
+        Update the signals with the messages published by a started CaroA04 instance, possibly in another process.
+        This instance does not need to be started.
+        :param reader: SharedStateReader instance attached to the shared memory segment of the started instance
+        :return: None
+        """
+        for slot, message in self._shared_messages().items():
+            sequence, timestamp, _, data = reader.read(slot)
+            if sequence > 0:
+                message.update_payload(data, timestamp)
+
+    def _shared_messages(self):
+        """Messages published in the shared state, by slot name"""
+        return {
+            'do': self.message_do,
+            'di': self.message_di,
+            'bitrate': self.message_bitrate,
+            'nodeid': self.message_nodeid,
+        }
+
+    def add_callback(self, callback):
+        """
+        Register a function to be called every time a received message has been decoded.
+        It is called from the reception thread, so it should return quickly.
+        :param callback: function taking the updated CanMessageRW instance and the reception timestamp
+        :return: None
+        """
+        if callback not in self._callbacks:
+            self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    def _publish(self, slot, msg):
+        if self._state_publisher is not None:
+            self._state_publisher.publish(slot, msg)
+
+    def _notify(self, message, msg):
+        for callback in self._callbacks:
+            callback(message, msg.timestamp)
+
     def _init_outputs(self):
         """
         To avoid overwriting the state of already set outputs, initialize by reading the current
@@ -146,19 +297,31 @@ class CaroA04:
     def _listener(self, msg):
         if msg.arbitration_id in (self.message_do.read_id, self.message_do.write_id):
             logger.debug(msg)
-            self.message_do.update_payload(msg.data)
+            self.message_do.update_payload(msg.data, msg.timestamp)
+            self._publish('do', msg)
+            self._notify(self.message_do, msg)
         elif msg.arbitration_id in (self.message_di.read_id, self.message_di.write_id):
             logger.debug(msg)
-            self.message_di.update_payload(msg.data)
+            self.message_di.update_payload(msg.data, msg.timestamp)
+            self._publish('di', msg)
+            self._notify(self.message_di, msg)
         elif msg.arbitration_id in (self.message_bitrate.read_id, self.message_bitrate.write_id):
             logger.debug(msg)
-            self.message_bitrate.update_payload(msg.data)
+            self.message_bitrate.update_payload(msg.data, msg.timestamp)
+            self._publish('bitrate', msg)
+            self._notify(self.message_bitrate, msg)
         elif msg.arbitration_id in (self.message_nodeid.read_id, self.message_nodeid.write_id):
             logger.debug(msg)
-            self.message_nodeid.update_payload(msg.data)
+            self.message_nodeid.update_payload(msg.data, msg.timestamp)
+            self._publish('nodeid', msg)
+            self._notify(self.message_nodeid, msg)
 
     def stop(self):
         """Stops any ongoing thread"""
+        for runner in self._sequences:
+            runner.cancel()
+            runner.join()
+        self._sequences = list()
         if self._notifier is not None:
             self._notifier.stop()
         if self._bus is not None:
@@ -168,6 +331,9 @@ class CaroA04:
         self.message_di.bus = None
         self.message_nodeid.bus = None
         self.message_bitrate.bus = None
+        if self._state_publisher is not None:
+            self._state_publisher.close()
+            self._state_publisher = None
 
 
 if __name__ == "__main__":
@@ -0,0 +1,399 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+import sys
+import pathlib
+sys.path.append(str(pathlib.Path(__file__).parent))
+
+from canmessage import BOOL, ENUM
+
+logger = logging.getLogger(__name__)
+logger.propagate = True
+
+__author__ = "R. Soyding"
+
+OUTPUTS = ('do1', 'do2', 'do3', 'do4')
+INPUTS = ('di1', 'di2', 'di3', 'di4')
+PARAMETERS = ('bitrate', 'node_id')
+BATCH_WINDOW_S = 0.002
+
+# Gateway protocol: newline-delimited JSON objects over a TCP or Unix stream socket.
+#
+# Requests, the optional "id" being copied in the response:
+#     {"id": 1, "op": "write", "signals": {"do1": true, "do3": false}}
+#     {"id": 2, "op": "read", "signals": ["di1", "do1"]}
+#     {"id": 3, "op": "param", "name": "bitrate"}
+#     {"id": 4, "op": "param", "name": "bitrate", "value": 500000}
+#     {"id": 5, "op": "subscribe", "signals": ["di1", "di2"]}
+#     {"id": 6, "op": "unsubscribe", "signals": ["di1"]}
+#
+# Responses:
+#     {"id": 2, "ok": true, "values": {"di1": false, "do1": true}}
+#     {"id": 7, "ok": false, "error": "unknown operation"}
+#
+# Events sent to subscribed clients when a received message changes the value of a subscribed signal:
+#     {"event": "update", "timestamp": 1716000000.0, "values": {"di1": true}}
+
+
+def _phys(signal):
+    """Physical value of a signal, without sending a read request"""
+    if signal.type == BOOL:
+        return bool(signal.value)
+    elif signal.type == ENUM:
+        return signal.enum.get(signal.value, signal.value)
+    return signal.value
+
+
+class _Request:
+    def __init__(self, op, args):
+        self.op = op
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class _Client:
+    """Connected client, its outgoing messages are sent by a dedicated thread so that events never block"""
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.subscriptions = set()
+        self.last_values = dict()
+        self._outgoing = queue.Queue()
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    def send(self, obj):
+        self._outgoing.put(obj)
+
+    def close(self):
+        self._outgoing.put(None)
+        self._writer.join()
+
+    def _write(self):
+        while True:
+            obj = self._outgoing.get()
+            if obj is None:
+                break
+            try:
+                self.wfile.write(json.dumps(obj).encode() + b'\n')
+                self.wfile.flush()
+            except OSError:
+                break
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        gateway = self.server.gateway
+        client = _Client(self.wfile)
+        gateway._add_client(client)
+        try:
+            for line in self.rfile:
+                if line.strip():
+                    client.send(gateway._handle(client, line))
+        except OSError:
+            pass
+        finally:
+            gateway._remove_client(client)
+            client.close()
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+class CaroGateway:
+    """
+    Shares a started CaroA04 instance with many clients connected to a local socket (see protocol above).
+    Every bus access goes through a single thread: the requests received within a short window are merged, so that
+    the output writes of all clients are sent in a single DO message and their reads share a single DI/DO read.
+    """
+    def __init__(self, caro, address, batch_window=BATCH_WINDOW_S):
+        """
+        :param caro: started CaroA04 instance
+        :param address: (host, port) tuple to listen on TCP, or path of a Unix socket
+        :param batch_window: time during which requests are collected before being executed, in seconds
+        """
+        self.caro = caro
+        self.address = address
+        self.batch_window = batch_window
+        self._signals = {name: getattr(caro, name) for name in OUTPUTS + INPUTS + PARAMETERS}
+        self._requests = queue.Queue()
+        self._clients = set()
+        self._clients_lock = threading.Lock()
+        self._server = None
+        self._threads = list()
+
+    def start(self):
+        """
+        Start listening and serving the clients.
+        :return: None
+        """
+        if isinstance(self.address, tuple):
+            self._server = _TCPServer(self.address, _Handler)
+        else:
+            assert hasattr(socketserver, 'ThreadingUnixStreamServer'), "Unix sockets not supported on this platform"
+            self._server = _UnixServer(self.address, _Handler)
+        self._server.gateway = self
+        self.address = self._server.server_address  # actual address when an ephemeral port is requested
+
+        self.caro.add_callback(self._on_message)
+        self._threads = [threading.Thread(target=self._server.serve_forever, daemon=True),
+                         threading.Thread(target=self._process_requests, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stop serving the clients. The CaroA04 instance is not stopped."""
+        self.caro.remove_callback(self._on_message)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            if not isinstance(self.address, tuple) and os.path.exists(self.address):
+                os.unlink(self.address)
+        self._requests.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = list()
+
+    def _add_client(self, client):
+        with self._clients_lock:
+            self._clients.add(client)
+
+    def _remove_client(self, client):
+        with self._clients_lock:
+            self._clients.discard(client)
+
+    def _handle(self, client, line):
+        """Execute a request line and build the response"""
+        response = dict()
+        try:
+            request = json.loads(line)
+            response['id'] = request.get('id')
+            op = request.get('op')
+            if op == 'write':
+                states = request['signals']
+                assert all(name in OUTPUTS for name in states), "only outputs can be written"
+                self._submit(op, states)
+            elif op == 'read':
+                names = request['signals']
+                assert all(name in OUTPUTS + INPUTS for name in names), "only inputs and outputs can be read"
+                response['values'] = self._submit(op, names)
+            elif op == 'param':
+                assert request['name'] in PARAMETERS, "unknown parameter"
+                response['values'] = self._submit(op, (request['name'], request.get('value')))
+            elif op == 'subscribe':
+                names = request['signals']
+                assert all(name in self._signals for name in names), "unknown signal"
+                client.subscriptions.update(names)
+            elif op == 'unsubscribe':
+                client.subscriptions.difference_update(request.get('signals', self._signals))
+            else:
+                raise AssertionError("unknown operation")
+            response['ok'] = True
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            response['ok'] = False
+            response['error'] = str(e)
+
+        return response
+
+    def _submit(self, op, args):
+        """Queue a request for the bus thread and wait for its result"""
+        request = _Request(op, args)
+        self._requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise ValueError(request.error)
+        return request.result
+
+    def _process_requests(self):
+        """Bus thread: collect the requests received during the batch window and execute them together"""
+        while True:
+            request = self._requests.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.monotonic() + self.batch_window
+            remaining = self.batch_window
+            while remaining > 0:
+                try:
+                    request = self._requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request is None:
+                    self._requests.put(None)  # stop once this batch is done
+                    break
+                batch.append(request)
+                remaining = deadline - time.monotonic()
+
+            try:
+                self._execute(batch)
+            except Exception as e:
+                logger.exception("Gateway batch failed")
+                for request in batch:
+                    request.error = str(e)
+            for request in batch:
+                request.done.set()
+
+    def _execute(self, batch):
+        writes = [request for request in batch if request.op == 'write']
+        reads = [request for request in batch if request.op == 'read']
+
+        if writes:
+            # later requests win when several clients write the same output
+            for request in writes:
+                for name, state in request.args.items():
+                    self._signals[name].value = int(bool(state))
+            self.caro.message_do.write()
+
+        names = set(name for request in reads for name in request.args)
+        if names.intersection(INPUTS):
+            self.caro.message_di.read()
+        if names.intersection(OUTPUTS):
+            self.caro.message_do.read()
+        for request in reads:
+            request.result = {name: _phys(self._signals[name]) for name in request.args}
+
+        for request in batch:
+            if request.op == 'param':
+                name, value = request.args
+                signal = self._signals[name]
+                if value is not None:
+                    signal.phys = value
+                signal.parent.read()
+                request.result = {name: _phys(signal)}
+
+    def _on_message(self, message, timestamp):
+        """Push the changed values of the decoded message to the subscribed clients"""
+        values = {name: _phys(signal) for name, signal in self._signals.items() if signal.parent is message}
+        with self._clients_lock:
+            clients = list(self._clients)
+        for client in clients:
+            changed = {name: value for name, value in values.items()
+                       if name in client.subscriptions and client.last_values.get(name) != value}
+            if changed:
+                client.last_values.update(changed)
+                client.send({'event': 'update', 'timestamp': timestamp, 'values': changed})
+
+
+class GatewayClient:
+    """
+    Minimal client of the gateway protocol.
+    Events received for the subscribed signals are put in the events queue.
+    """
+    def __init__(self, address, timeout=5.0):
+        """
+        :param address: (host, port) tuple or path of the Unix socket the gateway listens on
+        :param timeout: time to wait for a response, in seconds
+        """
+        if isinstance(address, tuple):
+            self._socket = socket.create_connection(address)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(address)
+        self.timeout = timeout
+        self.events = queue.Queue()
+        self._responses = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def request(self, op, **kwargs):
+        """
+        Send a request and wait for its response.
+        :param op: operation (write, read, param, subscribe, unsubscribe)
+        :param kwargs: other fields of the request
+        :return: response
+        """
+        with self._lock:
+            self._next_id += 1
+            request = dict(id=self._next_id, op=op, **kwargs)
+            self._socket.sendall(json.dumps(request).encode() + b'\n')
+            response = self._responses.get(timeout=self.timeout)
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response
+
+    def write(self, **states):
+        self.request('write', signals=states)
+
+    def read(self, *names):
+        return self.request('read', signals=names)['values']
+
+    def param(self, name, value=None):
+        return self.request('param', name=name, value=value)['values'][name]
+
+    def subscribe(self, *names):
+        self.request('subscribe', signals=names)
+
+    def unsubscribe(self, *names):
+        self.request('unsubscribe', signals=names)
+
+    def close(self):
+        self._socket.shutdown(socket.SHUT_RDWR)  # unblocks the reader thread
+        self._socket.close()
+        self._reader.join()
+
+    def _read(self):
+        with self._socket.makefile('rb') as rfile:
+            try:
+                for line in rfile:
+                    message = json.loads(line)
+                    if 'event' in message:
+                        self.events.put(message)
+                    else:
+                        self._responses.put(message)
+            except (OSError, ValueError):
+                pass
+
+
+def main(argv=None):
+    """Run a gateway daemon owning the bus, until interrupted"""
+    from caroa04 import CaroA04
+
+    parser = argparse.ArgumentParser(description="Share a CAROA04 device with many local clients.")
+    parser.add_argument('--node-id', type=lambda value: int(value, 0), default=0xE0, help="device node ID")
+    parser.add_argument('--interface', help="CAN interface (e.g. pcan)")
+    parser.add_argument('--channel', help="CAN channel (e.g. PCAN_USBBUS1)")
+    parser.add_argument('--bitrate', type=int, help="CAN bitrate")
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument('--tcp', help="host:port to listen on")
+    listen.add_argument('--unix', help="path of the Unix socket to listen on")
+    args = parser.parse_args(argv)
+
+    if args.tcp is not None:
+        host, port = args.tcp.rsplit(':', 1)
+        address = (host, int(port))
+    else:
+        address = args.unix
+
+    caro = CaroA04()
+    caro.start(args.node_id, args.interface, args.bitrate, args.channel)
+    gateway = CaroGateway(caro, address)
+    gateway.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gateway.stop()
+        caro.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import can
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.propagate = True
+
+__author__ = "R. Soyding"
+
+SPIN_S = 0.002  # the last part of the wait before a deadline is spent polling the clock instead of sleeping
+
+
+class OutputSequence:
+    """
+    Timed pattern of output states, described with offsets in seconds from the start of the sequence.
+    Methods return the sequence itself so that they can be chained, e.g. to set do1 on for 50 ms, then pulse do2
+    every 200 ms 10 times:
+
+        OutputSequence().pulse('do1', at=0, width=0.05).repeat('do2', period=0.2, count=10, at=0.05)
+    """
+    def __init__(self):
+        self.events = list()  # (offset, output name, state)
+
+    def set(self, at, **states):
+        """
+        Set outputs states at a given time.
+        :param at: offset from the start of the sequence, in seconds
+        :param states: output name and state pairs (e.g. do1=True)
+        :return: the sequence
+        """
+        assert at >= 0, "Sequence offsets should be positive"
+        for name, state in states.items():
+            self.events.append((at, name, bool(state)))
+        return self
+
+    def pulse(self, name, at=0.0, width=0.05):
+        """
+        Set an output on, then off again.
+        :param name: output name (e.g. 'do1')
+        :param at: offset of the rising edge, in seconds
+        :param width: time the output stays on, in seconds
+        :return: the sequence
+        """
+        assert width > 0, "Pulse width should be positive"
+        self.set(at, **{name: True})
+        return self.set(at + width, **{name: False})
+
+    def repeat(self, name, period, count, at=0.0, width=None):
+        """
+        Pulse an output periodically.
+        :param name: output name (e.g. 'do1')
+        :param period: time between two rising edges, in seconds
+        :param count: number of pulses
+        :param at: offset of the first rising edge, in seconds
+        :param width: time the output stays on for each pulse, in seconds (half the period if None)
+        :return: the sequence
+        """
+        if width is None:
+            width = period / 2
+        assert width < period, "Pulse width should be smaller than the period"
+        for i in range(count):
+            self.pulse(name, at + i * period, width)
+        return self
+
+    @property
+    def duration(self):
+        return max((event[0] for event in self.events), default=0.0)
+
+    def steps(self):
+        """
+        Merge the events happening at the same time.
+        :return: list of (offset, {output name: state}) sorted by offset
+        """
+        steps = dict()
+        for at, name, state in sorted(self.events, key=lambda event: event[0]):
+            steps.setdefault(at, dict())[name] = state
+        return list(steps.items())
+
+
+class SequenceRunner(threading.Thread):
+    """
+    Thread sending precomputed messages at absolute deadlines.
+    Sleeping is only used until shortly before each deadline, the clock is polled for the remaining time.
+    The timing error of each step (time the message was handed to the bus minus its deadline, in seconds) is
+    stored in the results attribute.
+    """
+    def __init__(self, bus, steps):
+        """
+        :param bus: bus used to send the messages
+        :param steps: list of (offset, can.Message) sorted by offset
+        """
+        super().__init__(daemon=True)
+        self.bus = bus
+        self.steps = steps
+        self.results = list()  # (offset, timing error)
+        self._cancel = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        for offset, message in self.steps:
+            deadline = start + offset
+            remaining = deadline - time.perf_counter()
+            if remaining > SPIN_S and self._cancel.wait(remaining - SPIN_S):
+                break
+            if self._cancel.is_set():
+                break
+            while time.perf_counter() < deadline:
+                pass
+
+            self.bus.send(message)
+            error = time.perf_counter() - deadline
+            self.results.append((offset, error))
+            logger.debug("Sequence step at %.3f s sent with %.6f s error", offset, error)
+
+    def cancel(self):
+        """Stop the sequence before its next step"""
+        self._cancel.set()
@@ -0,0 +1,132 @@
+import logging
+import struct
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+logger.propagate = True
+
+__author__ = "R. Soyding"
+
+MAGIC = b'CARO'
+PAYLOAD_SIZE = 8
+NAME_SIZE = 16
+HEADER = struct.Struct('<4sHH')  # magic, number of slots, slot size
+SLOT_NAME = struct.Struct(f'<{NAME_SIZE}s')
+SLOT_SEQUENCE = struct.Struct('<Q')
+SLOT_MESSAGE = struct.Struct('<dIB3x')  # timestamp, arbitration ID, data length
+SLOT_SEQUENCE_OFFSET = SLOT_NAME.size
+SLOT_MESSAGE_OFFSET = SLOT_SEQUENCE_OFFSET + SLOT_SEQUENCE.size
+SLOT_PAYLOAD_OFFSET = SLOT_MESSAGE_OFFSET + SLOT_MESSAGE.size
+SLOT_SIZE = SLOT_PAYLOAD_OFFSET + PAYLOAD_SIZE
+
+# Shared memory layout:
+#     header: magic, number of slots, slot size
+#     one slot per message: name, sequence counter, timestamp, arbitration ID, data length, payload
+#
+# The sequence counter of a slot is odd while the slot is being written (seqlock). Readers copy the slot and retry
+# if the counter was odd or changed in the meantime, so they never wait for the writer nor exchange anything with it.
+# The counter is 0 as long as nothing has been published in the slot.
+
+
+class SharedStatePublisher:
+    """
+    Creates a shared memory segment and publishes the last received messages in it, one slot per message.
+    Only one process shall publish in a segment.
+    """
+    def __init__(self, name, slots):
+        """
+        :param name: name of the shared memory segment, used by the readers to attach to it
+        :param slots: names of the slots (e.g. 'do', 'di')
+        """
+        self.name = name
+        self._shm = shared_memory.SharedMemory(name=name, create=True, size=HEADER.size + len(slots) * SLOT_SIZE)
+        self._offsets = dict()
+        self._sequences = dict()
+
+        HEADER.pack_into(self._shm.buf, 0, MAGIC, len(slots), SLOT_SIZE)
+        for index, slot in enumerate(slots):
+            assert len(slot.encode()) <= NAME_SIZE, f"Slot name {slot} is too long"
+            offset = HEADER.size + index * SLOT_SIZE
+            SLOT_NAME.pack_into(self._shm.buf, offset, slot.encode())
+            SLOT_SEQUENCE.pack_into(self._shm.buf, offset + SLOT_SEQUENCE_OFFSET, 0)
+            self._offsets[slot] = offset
+            self._sequences[slot] = 0
+
+    def publish(self, slot, msg):
+        """
+        Write a received message in its slot.
+        :param slot: name of the slot
+        :param msg: can.Message instance
+        :return: None
+        """
+        offset = self._offsets[slot]
+        buf = self._shm.buf
+        data = msg.data[:PAYLOAD_SIZE]
+        sequence = self._sequences[slot]
+
+        SLOT_SEQUENCE.pack_into(buf, offset + SLOT_SEQUENCE_OFFSET, sequence + 1)
+        SLOT_MESSAGE.pack_into(buf, offset + SLOT_MESSAGE_OFFSET, msg.timestamp, msg.arbitration_id, len(data))
+        buf[offset + SLOT_PAYLOAD_OFFSET:offset + SLOT_PAYLOAD_OFFSET + len(data)] = data
+        SLOT_SEQUENCE.pack_into(buf, offset + SLOT_SEQUENCE_OFFSET, sequence + 2)
+        self._sequences[slot] = sequence + 2
+
+    def close(self):
+        """Release and destroy the shared memory segment"""
+        self._shm.close()
+        self._shm.unlink()
+
+
+class SharedStateReader:
+    """
+    Attaches to a shared memory segment created by a SharedStatePublisher, possibly in another process, to read
+    the last published messages.
+    """
+    def __init__(self, name, retries=1000):
+        """
+        :param name: name of the shared memory segment
+        :param retries: number of attempts to get a consistent copy of a slot before giving up
+        """
+        self.name = name
+        self.retries = retries
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # before python 3.13, the segment would be destroyed when this process exits unless unregistered
+            from multiprocessing import resource_tracker
+            self._shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+
+        magic, count, slot_size = HEADER.unpack_from(self._shm.buf, 0)
+        assert magic == MAGIC and slot_size == SLOT_SIZE, f"{name} is not a caroa04 shared state"
+        self._offsets = dict()
+        for index in range(count):
+            offset = HEADER.size + index * SLOT_SIZE
+            slot = SLOT_NAME.unpack_from(self._shm.buf, offset)[0].rstrip(b'\0').decode()
+            self._offsets[slot] = offset
+
+    @property
+    def slots(self):
+        return list(self._offsets)
+
+    def read(self, slot):
+        """
+        Get a consistent copy of the last message published in a slot.
+        :param slot: name of the slot
+        :return: (sequence, timestamp, arbitration ID, payload), sequence being 0 if nothing was published yet
+        """
+        offset = self._offsets[slot]
+        buf = self._shm.buf
+        for _ in range(self.retries):
+            sequence = SLOT_SEQUENCE.unpack_from(buf, offset + SLOT_SEQUENCE_OFFSET)[0]
+            if sequence % 2:
+                continue
+            timestamp, arbitration_id, length = SLOT_MESSAGE.unpack_from(buf, offset + SLOT_MESSAGE_OFFSET)
+            data = bytes(buf[offset + SLOT_PAYLOAD_OFFSET:offset + SLOT_PAYLOAD_OFFSET + length])
+            if SLOT_SEQUENCE.unpack_from(buf, offset + SLOT_SEQUENCE_OFFSET)[0] == sequence:
+                return sequence, timestamp, arbitration_id, data
+
+        raise RuntimeError(f"Could not get a consistent copy of slot {slot}")
+
+    def close(self):
+        """Detach from the shared memory segment"""
+        self._shm.close()
@@ -0,0 +1,64 @@
+from src.caroa04.canmessage import CanMessage, CanSignal, BOOL
+
+
+class TestSignalHistory:
+    def test_history_wraps_around(self):
+        message = CanMessage(0x300)
+        signal = CanSignal(startbit=0, length=8)
+        message.add(signal)
+        history = signal.enable_history(3)
+
+        for i in range(5):
+            message.update_payload([i, 0, 0, 0, 0, 0, 0, 0], timestamp=float(i))
+
+        assert len(history) == 3, "History should not grow beyond its capacity"
+        timestamps, values = history.last()
+        assert list(timestamps) == [2.0, 3.0, 4.0], "Oldest samples should be overwritten"
+        assert list(values) == [2, 3, 4], "Values should be returned in chronological order"
+        assert list(history.last(2)[1]) == [3, 4], "Last N samples are wrong"
+
+    def test_history_queries(self):
+        message = CanMessage(0x300)
+        signal = CanSignal(startbit=0, length=1, type=BOOL)
+        message.add(signal)
+        history = signal.enable_history(10)
+
+        for i, value in enumerate([0, 1, 1, 0, 0]):
+            message.update_payload([value, 0, 0, 0, 0, 0, 0, 0], timestamp=10.0 + i)
+
+        timestamps, values = history.since(12.0)
+        assert list(timestamps) == [12.0, 13.0, 14.0], "Samples since t are wrong"
+        assert history.max() == 1, "Maximum over the history is wrong"
+        assert history.max(since=13.0) == 0, "Maximum over the window is wrong"
+        assert history.min(since=11.0) == 0, "Minimum over the window is wrong"
+        assert history.min(since=20.0) is None, "Empty window should return None"
+
+
+class TestIncrementalDecode:
+    def test_only_changed_bytes_are_decoded(self):
+        message = CanMessage(0x300)
+        low = CanSignal(startbit=0, length=4)
+        high = CanSignal(startbit=4, length=4)
+        wide = CanSignal(startbit=16, length=16)
+        message.add(low, high, wide)
+
+        message.update_payload([0x21, 0, 0x34, 0x12, 0, 0, 0, 0])
+        assert (low.value, high.value, wide.value) == (0x1, 0x2, 0x1234), "Initial decode is wrong"
+
+        # a value decoded from a byte that did not change is left untouched
+        wide.value = 0
+        message.update_payload(bytearray([0x23, 0, 0x34, 0x12, 0, 0, 0, 0]))
+        assert (low.value, high.value, wide.value) == (0x3, 0x2, 0), "Only changed bytes should be decoded"
+
+        message.update_payload(bytearray([0x23, 0, 0x34, 0x56, 0, 0, 0, 0]))
+        assert wide.value == 0x5634, "Signal spanning a changed byte should be decoded"
+
+    def test_local_write_forces_full_decode(self):
+        message = CanMessage(0x300)
+        signal = CanSignal(startbit=0, length=1, type=BOOL)
+        message.add(signal)
+
+        message.update_payload([1, 0, 0, 0, 0, 0, 0, 0])
+        signal.phys = False
+        message.update_payload([1, 0, 0, 0, 0, 0, 0, 0])
+        assert signal.phys is True, "Identical frame after a local write should be decoded"
@@ -1,8 +1,15 @@
 import pytest
 import can
+import os
+import threading
+import time
 
-from src.caroa04.caroa04 import CaroA04, MSGID_DO_READ, MSGID_DO_WRITE, MSGID_DI_READ
+from src.caroa04.caroa04 import CaroA04, MSGID_DO_READ, MSGID_DO_WRITE, MSGID_DI_READ, MSGID_PARAM, \
+    GET_ADDR_CODE_CMD, BitrateEnum
 from src.caroa04.canmessage import CanMessage, CanSignal, BOOL
+from src.caroa04.sequence import OutputSequence
+from src.caroa04.sharedstate import SharedStateReader
+from src.caroa04.gateway import CaroGateway, GatewayClient
 
 
 class VirtualDevice:
@@ -50,13 +57,13 @@ class VirtualDevice:
             self.di4
         )
 
-    def start(self, node_id):
+    def start(self, node_id, channel=None):
         self.message_do_set.arbitration_id = (self.message_do_set.arbitration_id & 0x700) | node_id
         self.message_do_get.arbitration_id = (self.message_do_get.arbitration_id & 0x700) | node_id
         self.message_di.arbitration_id = (self.message_di.arbitration_id & 0x700) | node_id
 
         if self.bus is None:
-            self.bus = can.interface.Bus(interface='virtual')
+            self.bus = can.interface.Bus(interface='virtual', channel=channel)
             self.notifier = can.Notifier(self.bus, [self.listener], timeout=2.0)
 
     def listener(self, msg):
@@ -133,6 +140,17 @@ class TestVirtualCaroA04:
         caro.do4.phys = False
         assert virtualdevice.do4.phys is False, "Value of DO4 is wrong"
 
+    def test_sequence(self, caro, virtualdevice):
+        sequence = OutputSequence().pulse('do1', at=0, width=0.05).repeat('do2', period=0.02, count=3, at=0.05)
+        runner = caro.start_sequence(sequence)
+        runner.join(2)
+        time.sleep(0.1)  # let the device process the last message
+
+        assert [offset for offset, _ in runner.results] == pytest.approx([0, 0.05, 0.06, 0.07, 0.08, 0.09, 0.1]), \
+            "Sequence steps are wrong"
+        assert max(abs(error) for _, error in runner.results) < 0.05, "Sequence steps sent too late"
+        assert virtualdevice.do1.phys is False and virtualdevice.do2.phys is False, "Final state is wrong"
+
     def test_di1(self, caro, virtualdevice):
         assert caro.di1.phys is False, "Initial value of DI1 is wrong"
         virtualdevice.di1.phys = True
@@ -160,3 +178,115 @@ class TestVirtualCaroA04:
         assert caro.di4.phys is True, "Read value is not correct"
         virtualdevice.di4.phys = False
         assert caro.di4.phys is False, "Read value is not correct"
+
+
+class TestScan:
+    @pytest.fixture
+    def devices(self):
+        """Simulate two devices answering the address code requests on their own virtual channel"""
+        node_ids = (0x10, 0xE5)
+        bus = can.interface.Bus(interface='virtual', channel='scan')
+
+        def listener(msg):
+            node_id = msg.arbitration_id & 0xFF
+            if msg.arbitration_id & 0x700 == MSGID_PARAM and msg.data[0] == GET_ADDR_CODE_CMD and node_id in node_ids:
+                bus.send(can.Message(arbitration_id=msg.arbitration_id,
+                                     data=[GET_ADDR_CODE_CMD, node_id, 0, 0, 0, 0, 0, 0],
+                                     is_extended_id=False))
+
+        notifier = can.Notifier(bus, [listener], timeout=2.0)
+        yield node_ids
+        notifier.stop()
+        bus.shutdown()
+
+    def test_scan(self, devices):
+        found = CaroA04.scan('virtual', 'scan', timeout=0.5)
+        assert found == [(node_id, None) for node_id in devices], "Scanned devices are wrong"
+
+    def test_scan_all_bitrates(self, devices):
+        found = CaroA04.scan('virtual', 'scan', all_bitrates=True, timeout=0.1)
+        assert len(found) == len(devices) * len(BitrateEnum), "Every bitrate should be scanned"
+
+
+class TestSharedState:
+    def test_shared_state(self):
+        name = f"caroa04_test_{os.getpid()}"
+        caro = CaroA04()
+        caro.start(0xE0, 'virtual', channel='shared', shared_state=name)
+        device = can.interface.Bus(interface='virtual', channel='shared')
+        reader = SharedStateReader(name)
+        try:
+            assert reader.read('di')[0] == 0, "Nothing should be published before a message is received"
+            device.send(can.Message(arbitration_id=MSGID_DI_READ | 0xE0, data=[0x05, 0, 0, 0, 0, 0, 0, 0],
+                                    is_extended_id=False))
+            time.sleep(0.2)
+
+            sequence, _, arbitration_id, data = reader.read('di')
+            assert sequence == 2 and arbitration_id == MSGID_DI_READ | 0xE0, "DI message not published"
+            assert data == bytes([0x05, 0, 0, 0, 0, 0, 0, 0]), "Published payload is wrong"
+
+            client = CaroA04()
+            client.load_shared_state(reader)
+            assert (client.di1.phys, client.di2.phys, client.di3.phys) == (True, False, True), \
+                "Signals not updated from the shared state"
+        finally:
+            reader.close()
+            device.shutdown()
+            caro.stop()
+
+
+class TestGateway:
+    @pytest.fixture
+    def gateway(self):
+        caro = CaroA04()
+        device = VirtualDevice()
+        device.start(0xE0, channel='gateway')
+        caro.start(0xE0, 'virtual', channel='gateway')
+        gateway = CaroGateway(caro, ('127.0.0.1', 0), batch_window=0.05)
+        gateway.start()
+
+        yield gateway, device
+
+        gateway.stop()
+        caro.stop()
+        device.stop()
+
+    def test_writes_are_batched(self, gateway):
+        gateway, device = gateway
+        clients = [GatewayClient(gateway.address) for _ in range(2)]
+        sent = list()
+        gateway.caro.message_do.bus.send = lambda msg, *args, send=gateway.caro.message_do.bus.send: \
+            (sent.append(msg), send(msg, *args))
+
+        threads = [threading.Thread(target=clients[0].write, kwargs=dict(do1=True)),
+                   threading.Thread(target=clients[1].write, kwargs=dict(do2=True))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.1)
+
+        assert device.do1.phys is True and device.do2.phys is True, "Outputs of both clients not written"
+        assert len(sent) == 1, "Writes of both clients should be sent in a single message"
+        for client in clients:
+            client.close()
+
+    def test_subscribe(self, gateway):
+        gateway, device = gateway
+        client = GatewayClient(gateway.address)
+        client.subscribe('di2')
+
+        device.di2.phys = True
+        device.bus.send(can.Message(arbitration_id=device.message_di.arbitration_id,
+                                    data=device.message_di.payload, is_extended_id=False))
+
+        event = client.events.get(timeout=2)
+        assert event['values'] == {'di2': True}, "Subscribed signal change not pushed"
+        client.close()
+
+    def test_invalid_request(self, gateway):
+        gateway, _ = gateway
+        client = GatewayClient(gateway.address)
+        with pytest.raises(ValueError):
+            client.write(di1=True)
+        client.close()